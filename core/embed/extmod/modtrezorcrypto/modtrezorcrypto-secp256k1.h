@@ -148,6 +148,32 @@ STATIC MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(mod_trezorcrypto_secp256k1_sign_obj,
                                            2, 4,
                                            mod_trezorcrypto_secp256k1_sign);
 
+/// def sign_der(secret_key: bytes, digest: bytes) -> bytes:
+///     """
+///     Uses secret key to produce the DER-encoded signature of the digest.
+///     """
+STATIC mp_obj_t mod_trezorcrypto_secp256k1_sign_der(mp_obj_t secret_key,
+                                                    mp_obj_t digest) {
+  mp_buffer_info_t sk, dig;
+  mp_get_buffer_raise(secret_key, &sk, MP_BUFFER_READ);
+  mp_get_buffer_raise(digest, &dig, MP_BUFFER_READ);
+  if (sk.len != 32) {
+    mp_raise_ValueError("Invalid length of secret key");
+  }
+  if (dig.len != 32) {
+    mp_raise_ValueError("Invalid length of digest");
+  }
+  uint8_t sig[64], der[72];
+  if (0 != ecdsa_sign_digest(&secp256k1, (const uint8_t *)sk.buf,
+                             (const uint8_t *)dig.buf, sig, NULL, NULL)) {
+    mp_raise_ValueError("Signing failed");
+  }
+  int len = ecdsa_sig_to_der(sig, der);
+  return mp_obj_new_bytes(der, len);
+}
+STATIC MP_DEFINE_CONST_FUN_OBJ_2(mod_trezorcrypto_secp256k1_sign_der_obj,
+                                 mod_trezorcrypto_secp256k1_sign_der);
+
 /// def verify(public_key: bytes, signature: bytes, digest: bytes) -> bool:
 ///     """
 ///     Uses public key to verify the signature of the digest.
@@ -250,6 +276,8 @@ STATIC const mp_rom_map_elem_t mod_trezorcrypto_secp256k1_globals_table[] = {
      MP_ROM_PTR(&mod_trezorcrypto_secp256k1_publickey_obj)},
     {MP_ROM_QSTR(MP_QSTR_sign),
      MP_ROM_PTR(&mod_trezorcrypto_secp256k1_sign_obj)},
+    {MP_ROM_QSTR(MP_QSTR_sign_der),
+     MP_ROM_PTR(&mod_trezorcrypto_secp256k1_sign_der_obj)},
     {MP_ROM_QSTR(MP_QSTR_verify),
      MP_ROM_PTR(&mod_trezorcrypto_secp256k1_verify_obj)},
     {MP_ROM_QSTR(MP_QSTR_verify_recover),
@@ -27,6 +27,13 @@ def sign(
     """
 
 
+# extmod/modtrezorcrypto/modtrezorcrypto-secp256k1.h
+def sign_der(secret_key: bytes, digest: bytes) -> bytes:
+    """
+    Uses secret key to produce the DER-encoded signature of the digest.
+    """
+
+
 # extmod/modtrezorcrypto/modtrezorcrypto-secp256k1.h
 def verify(public_key: bytes, signature: bytes, digest: bytes) -> bool:
     """
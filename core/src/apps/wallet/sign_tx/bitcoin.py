@@ -1,6 +1,6 @@
-import gc
 from micropython import const
 
+from trezor.crypto import bip32
 from trezor.crypto.hashlib import sha256
 from trezor.messages import FailureType, InputScriptType
 from trezor.messages.SignTx import SignTx
@@ -27,7 +27,7 @@ from apps.wallet.sign_tx.common import SigningError, ecdsa_sign
 from apps.wallet.sign_tx.matchcheck import MultisigFingerprintChecker, WalletPathChecker
 
 if False:
-    from typing import Set, Tuple, Union
+    from typing import Dict, List, Optional, Tuple, Union
 
 # Default signature hash type in Bitcoin which signs all inputs and all outputs of the transaction.
 _SIGHASH_ALL = const(0x01)
@@ -42,6 +42,12 @@ _BIP32_MAX_LAST_ELEMENT = const(1000000)
 # the number of bytes to preallocate for serialized transaction chunks
 _MAX_SERIALIZED_CHUNK_SIZE = const(2048)
 
+# the maximum number of segwit input nodes kept from Step 4 to Step 6
+_MAX_CACHED_NODES = const(8)
+
+# the maximum number of bytes of serialized outputs kept from Step 2 to Steps 4 and 5
+_MAX_SERIALIZED_OUTPUTS_SIZE = const(4096)
+
 
 class Bitcoin:
     async def signer(self) -> None:
@@ -76,14 +82,28 @@ class Bitcoin:
         self.tx = helpers.sanitize_sign_tx(tx, coin)
         self.keychain = keychain
 
+        # sighash type of all the signatures, it does not change during signing
+        self.hash_type = self.get_hash_type()
+
+        # nodes of segwit inputs derived in Step 4 and used again in Step 6, keyed
+        # by path
+        self.node_cache = {}  # type: Dict[Tuple[int, ...], bip32.HDNode]
+        # pubkey hashes of the nodes in node_cache
+        self.pubkeyhash_cache = {}  # type: Dict[Tuple[int, ...], bytes]
+
         # checksum of multisig inputs, used to validate change-output
         self.multisig_fingerprint = MultisigFingerprintChecker()
 
         # common prefix of input paths, used to validate change-output
         self.wallet_path = WalletPathChecker()
 
-        # set of indices of inputs which are segwit
-        self.segwit = set()  # type: Set[int]
+        # outputs serialized in Step 2, reused when signing and serializing, and
+        # their total size in bytes
+        self.serialized_outputs = []  # type: List[bytes]
+        self.serialized_outputs_size = 0
+
+        # bitmap of inputs which are segwit, one bit per input index
+        self.segwit = bytearray((self.tx.inputs_count + 7) >> 3)
 
         # amounts
         self.total_in = 0  # sum of input amounts
@@ -101,8 +121,14 @@ class Bitcoin:
 
         # h_confirmed is used to make sure that the inputs and outputs streamed for
         # confirmation in Steps 1 and 2 are the same as the ones streamed for signing
-        # legacy inputs in Step 4.
-        self.h_confirmed = self.create_hash_writer()  # not a real tx hash
+        # legacy inputs in Step 4. The outputs are signed as they were serialized in
+        # Step 2, so only their streamed fields are checked.
+        # Coins which never use the legacy sighash skip it altogether.
+        self.legacy_sighash = self.uses_legacy_sighash()
+        self.h_confirmed = None  # type: Optional[HashWriter]
+        if self.legacy_sighash:
+            self.h_confirmed = self.create_hash_writer()  # not a real tx hash
+        self.h_confirmed_digest = None  # type: Optional[bytes]
 
         # BIP-0143 transaction hashing
         self.init_hash143()
@@ -110,6 +136,36 @@ class Bitcoin:
     def create_hash_writer(self) -> HashWriter:
         return HashWriter(sha256())
 
+    def set_segwit(self, i: int) -> None:
+        self.segwit[i >> 3] |= 1 << (i & 7)
+
+    def is_segwit(self, i: int) -> bool:
+        return bool(self.segwit[i >> 3] & (1 << (i & 7)))
+
+    def derive_node(self, address_n: List[int], keep: bool = False) -> bip32.HDNode:
+        # Segwit inputs are derived when serialized in Step 4 and again when signed
+        # in Step 6. With keep set, the node is kept for the second derivation. Both
+        # steps walk the inputs in order, so the first _MAX_CACHED_NODES nodes are
+        # kept rather than evicting them before Step 6 gets to read them.
+        key = tuple(address_n)
+        node = self.node_cache.get(key)
+        if node is None:
+            node = self.keychain.derive(address_n, self.coin.curve_name)
+            if keep and len(self.node_cache) < _MAX_CACHED_NODES:
+                self.node_cache[key] = node
+        return node
+
+    def derive_pubkeyhash(self, address_n: List[int], pubkey: bytes) -> bytes:
+        # pubkey belongs to address_n and is hashed on a miss. The pubkey hash is
+        # kept only together with its node.
+        key = tuple(address_n)
+        pubkeyhash = self.pubkeyhash_cache.get(key)
+        if pubkeyhash is None:
+            pubkeyhash = addresses.ecdsa_hash_pubkey(pubkey, self.coin)
+            if key in self.node_cache:
+                self.pubkeyhash_cache[key] = pubkeyhash
+        return pubkeyhash
+
     async def step1_process_inputs(self) -> None:
         for i in range(self.tx.inputs_count):
             # STAGE_REQUEST_1_INPUT in legacy
@@ -117,17 +173,24 @@ class Bitcoin:
             txi = await helpers.request_tx_input(self.tx_req, i, self.coin)
             self.weight.add_input(txi)
             if input_is_segwit(txi):
-                self.segwit.add(i)
+                self.set_segwit(i)
             await self.process_input(txi)
 
     async def step2_confirm_outputs(self) -> None:
         for i in range(self.tx.outputs_count):
             # STAGE_REQUEST_3_OUTPUT in legacy
             txo = await helpers.request_tx_output(self.tx_req, i, self.coin)
+            if self.legacy_sighash:
+                # before output_derive_script(), which fills in the change address
+                writers.write_tx_output_check(self.h_confirmed, txo)
             script_pubkey = self.output_derive_script(txo)
             self.weight.add_output(script_pubkey)
             await self.confirm_output(txo, script_pubkey)
 
+        # h_confirmed is complete, finalize it once instead of for every legacy input
+        if self.legacy_sighash:
+            self.h_confirmed_digest = self.h_confirmed.get_digest()
+
     async def step3_confirm_tx(self) -> None:
         fee = self.total_in - self.total_out
 
@@ -149,12 +212,12 @@ class Bitcoin:
             raise SigningError(FailureType.ActionCancelled, "Total cancelled")
 
     async def step4_serialize_inputs(self) -> None:
-        self.write_tx_header(self.serialized_tx, self.tx, bool(self.segwit))
+        self.write_tx_header(self.serialized_tx, self.tx, any(self.segwit))
         writers.write_varint(self.serialized_tx, self.tx.inputs_count)
 
         for i in range(self.tx.inputs_count):
             progress.advance()
-            if i in self.segwit:
+            if self.is_segwit(i):
                 await self.serialize_segwit_input(i)
             else:
                 await self.sign_nonsegwit_input(i)
@@ -166,10 +229,10 @@ class Bitcoin:
             await self.serialize_output(i)
 
     async def step6_sign_segwit_inputs(self) -> None:
-        any_segwit = bool(self.segwit)
+        any_segwit = any(self.segwit)
         for i in range(self.tx.inputs_count):
             progress.advance()
-            if i in self.segwit:
+            if self.is_segwit(i):
                 await self.sign_segwit_input(i)
             elif any_segwit:
                 # add empty witness for non-segwit inputs
@@ -182,7 +245,8 @@ class Bitcoin:
     async def process_input(self, txi: TxInputType) -> None:
         self.wallet_path.add_input(txi)
         self.multisig_fingerprint.add_input(txi)
-        writers.write_tx_input_check(self.h_confirmed, txi)
+        if self.legacy_sighash:
+            writers.write_tx_input_check(self.h_confirmed, txi)
         self.hash143_add_input(txi)  # all inputs are included (non-segwit as well)
 
         if not addresses.validate_full_path(txi.address_n, self.coin, txi.script_type):
@@ -216,7 +280,7 @@ class Bitcoin:
         elif not await helpers.confirm_output(txo, self.coin):
             raise SigningError(FailureType.ActionCancelled, "Output cancelled")
 
-        self.write_tx_output(self.h_confirmed, txo, script_pubkey)
+        self.save_serialized_output(txo, script_pubkey)
         self.hash143_add_output(txo, script_pubkey)
         self.total_out += txo.amount
 
@@ -235,12 +299,19 @@ class Bitcoin:
         # NOTE: No need to check the multisig fingerprint, because we won't be signing
         # the script here. Signatures are produced in STAGE_REQUEST_SEGWIT_WITNESS.
 
-        node = self.keychain.derive(txi.address_n, self.coin.curve_name)
+        node = self.derive_node(txi.address_n, keep=True)
         key_sign_pub = node.public_key()
-        script_sig = self.input_derive_script(txi, key_sign_pub)
+        if txi.script_type == InputScriptType.SPENDP2SHWITNESS and not txi.multisig:
+            # p2wpkh in p2sh, the pubkey hash is needed again in Step 6
+            pubkeyhash = self.derive_pubkeyhash(txi.address_n, key_sign_pub)
+        else:
+            pubkeyhash = None
+        script_sig = self.input_derive_script(txi, key_sign_pub, pubkeyhash=pubkeyhash)
         self.write_tx_input(self.serialized_tx, txi, script_sig)
 
-    def sign_bip143_input(self, txi: TxInputType) -> Tuple[bytes, bytes]:
+    def sign_bip143_input(
+        self, txi: TxInputType
+    ) -> Tuple[bytes, bytes, Optional[List[bytes]]]:
         self.wallet_path.check_input(txi)
         self.multisig_fingerprint.check_input(txi)
 
@@ -250,15 +321,20 @@ class Bitcoin:
             )
         self.bip143_in -= txi.amount
 
-        node = self.keychain.derive(txi.address_n, self.coin.curve_name)
+        node = self.derive_node(txi.address_n)
         public_key = node.public_key()
+        # the multisig pubkeys are derived once and returned for the input script
+        if txi.multisig:
+            pubkeys = multisig.multisig_get_pubkeys(txi.multisig)
+        else:
+            pubkeys = None
         hash143_hash = self.hash143_preimage_hash(
-            txi, addresses.ecdsa_hash_pubkey(public_key, self.coin)
+            txi, self.derive_pubkeyhash(txi.address_n, public_key), pubkeys
         )
 
         signature = ecdsa_sign(node, hash143_hash)
 
-        return public_key, signature
+        return public_key, signature, pubkeys
 
     async def sign_segwit_input(self, i: int) -> None:
         # STAGE_REQUEST_SEGWIT_WITNESS in legacy
@@ -269,20 +345,20 @@ class Bitcoin:
                 FailureType.ProcessError, "Transaction has changed during signing"
             )
 
-        public_key, signature = self.sign_bip143_input(txi)
+        public_key, signature, pubkeys = self.sign_bip143_input(txi)
 
         self.set_serialized_signature(i, signature)
         if txi.multisig:
             # find out place of our signature based on the pubkey
-            signature_index = multisig.multisig_pubkey_index(txi.multisig, public_key)
+            signature_index = multisig.multisig_find_pubkey(pubkeys, public_key)
             self.serialized_tx.extend(
                 scripts.witness_p2wsh(
-                    txi.multisig, signature, signature_index, self.get_hash_type()
+                    txi.multisig, pubkeys, signature, signature_index, self.hash_type
                 )
             )
         else:
             self.serialized_tx.extend(
-                scripts.witness_p2wpkh(signature, public_key, self.get_hash_type())
+                scripts.witness_p2wpkh(signature, public_key, self.hash_type)
             )
 
     async def sign_nonsegwit_input(self, i_sign: int) -> None:
@@ -294,28 +370,37 @@ class Bitcoin:
         self.write_tx_header(h_sign, self.tx, witness_marker=False)
         writers.write_varint(h_sign, self.tx.inputs_count)
 
+        # All the inputs and outputs are streamed again for every legacy input,
+        # keep the names used in the loops local.
+        tx_req = self.tx_req
+        coin = self.coin
+        request_tx_input = helpers.request_tx_input
+        write_tx_input_check = writers.write_tx_input_check
+
         for i in range(self.tx.inputs_count):
             # STAGE_REQUEST_4_INPUT in legacy
-            txi = await helpers.request_tx_input(self.tx_req, i, self.coin)
-            writers.write_tx_input_check(h_check, txi)
+            txi = await request_tx_input(tx_req, i, coin)
+            write_tx_input_check(h_check, txi)
             if i == i_sign:
                 self.wallet_path.check_input(txi)
                 self.multisig_fingerprint.check_input(txi)
                 # NOTE: wallet_path is checked in write_tx_input_check()
-                node = self.keychain.derive(txi.address_n, self.coin.curve_name)
+                node = self.derive_node(txi.address_n)
                 key_sign_pub = node.public_key()
+                pubkeys = None
                 # if multisig, do a sanity check to ensure we are signing with a key that is included in the multisig
                 if txi.multisig:
-                    multisig.multisig_pubkey_index(txi.multisig, key_sign_pub)
+                    pubkeys = multisig.multisig_get_pubkeys(txi.multisig)
+                    multisig.multisig_find_pubkey(pubkeys, key_sign_pub)
 
                 # For the signing process the previous UTXO's scriptPubKey is included in h_sign.
                 if txi.script_type == InputScriptType.SPENDMULTISIG:
                     script_pubkey = scripts.output_script_multisig(
-                        multisig.multisig_get_pubkeys(txi.multisig), txi.multisig.m,
+                        pubkeys, txi.multisig.m
                     )
                 elif txi.script_type == InputScriptType.SPENDADDRESS:
                     script_pubkey = scripts.output_script_p2pkh(
-                        addresses.ecdsa_hash_pubkey(key_sign_pub, self.coin)
+                        self.derive_pubkeyhash(txi.address_n, key_sign_pub)
                     )
                 else:
                     raise SigningError(
@@ -328,18 +413,21 @@ class Bitcoin:
 
         writers.write_varint(h_sign, self.tx.outputs_count)
 
+        request_tx_output = helpers.request_tx_output
+        write_tx_output_check = writers.write_tx_output_check
+        write_serialized_output = self.write_serialized_output
+
         for i in range(self.tx.outputs_count):
             # STAGE_REQUEST_4_OUTPUT in legacy
-            txo = await helpers.request_tx_output(self.tx_req, i, self.coin)
-            script_pubkey = self.output_derive_script(txo)
-            self.write_tx_output(h_check, txo, script_pubkey)
-            self.write_tx_output(h_sign, txo, script_pubkey)
+            txo = await request_tx_output(tx_req, i, coin)
+            write_tx_output_check(h_check, txo)
+            write_serialized_output(h_sign, i, txo)
 
         writers.write_uint32(h_sign, self.tx.lock_time)
-        writers.write_uint32(h_sign, self.get_hash_type())
+        writers.write_uint32(h_sign, self.hash_type)
 
         # check the control digests
-        if self.h_confirmed.get_digest() != h_check.get_digest():
+        if self.h_confirmed_digest != h_check.get_digest():
             raise SigningError(
                 FailureType.ProcessError, "Transaction has changed during signing"
             )
@@ -350,16 +438,16 @@ class Bitcoin:
         )
 
         # serialize input with correct signature
-        gc.collect()
-        script_sig = self.input_derive_script(txi_sign, key_sign_pub, signature)
+        script_sig = self.input_derive_script(
+            txi_sign, key_sign_pub, signature, pubkeys
+        )
         self.write_tx_input(self.serialized_tx, txi_sign, script_sig)
         self.set_serialized_signature(i_sign, signature)
 
     async def serialize_output(self, i: int) -> None:
         # STAGE_REQUEST_5_OUTPUT in legacy
         txo = await helpers.request_tx_output(self.tx_req, i, self.coin)
-        script_pubkey = self.output_derive_script(txo)
-        self.write_tx_output(self.serialized_tx, txo, script_pubkey)
+        self.write_serialized_output(self.serialized_tx, i, txo)
 
     async def get_prevtx_output_value(self, prev_hash: bytes, prev_index: int) -> int:
         amount_out = 0  # output amount
@@ -417,6 +505,11 @@ class Bitcoin:
     def get_hash_type(self) -> int:
         return _SIGHASH_ALL
 
+    def uses_legacy_sighash(self) -> bool:
+        # Non-segwit inputs are signed with the original sighash algorithm, which
+        # re-streams all the inputs and outputs and checks them against h_confirmed.
+        return True
+
     def write_tx_input(
         self, w: writers.Writer, txi: TxInputType, script: bytes
     ) -> None:
@@ -430,6 +523,33 @@ class Bitcoin:
     ) -> None:
         writers.write_tx_output(w, txo, script_pubkey)
 
+    def serialize_tx_output(self, txo: TxOutputType, script_pubkey: bytes) -> bytes:
+        # amount, script version (Decred), script length and script
+        w = writers.empty_bytearray(8 + 2 + 5 + len(script_pubkey))
+        self.write_tx_output(w, txo, script_pubkey)
+        return w
+
+    def save_serialized_output(self, txo: TxOutputType, script_pubkey: bytes) -> None:
+        # The outputs are kept serialized for Steps 4 and 5 up to a total of
+        # _MAX_SERIALIZED_OUTPUTS_SIZE bytes. From the first output which does not
+        # fit, the outputs are derived again from the data streamed in those steps.
+        if self.serialized_outputs_size > _MAX_SERIALIZED_OUTPUTS_SIZE:
+            return
+        serialized = self.serialize_tx_output(txo, script_pubkey)
+        self.serialized_outputs_size += len(serialized)
+        if self.serialized_outputs_size <= _MAX_SERIALIZED_OUTPUTS_SIZE:
+            self.serialized_outputs.append(serialized)
+
+    def write_serialized_output(
+        self, w: writers.Writer, i: int, txo: TxOutputType
+    ) -> None:
+        # The saved outputs are written as they were confirmed in Step 2, txo is the
+        # same output streamed again.
+        if i < len(self.serialized_outputs):
+            writers.write_bytes_unchecked(w, self.serialized_outputs[i])
+        else:
+            self.write_tx_output(w, txo, self.output_derive_script(txo))
+
     def write_tx_header(
         self,
         w: writers.Writer,
@@ -470,7 +590,7 @@ class Bitcoin:
                 ]
             except KeyError:
                 raise SigningError(FailureType.DataError, "Invalid script type")
-            node = self.keychain.derive(txo.address_n, self.coin.curve_name)
+            node = self.derive_node(txo.address_n)
             txo.address = addresses.get_address(
                 input_script_type, self.coin, node, txo.multisig
             )
@@ -493,10 +613,15 @@ class Bitcoin:
     # ===
 
     def input_derive_script(
-        self, txi: TxInputType, pubkey: bytes, signature: bytes = None
+        self,
+        txi: TxInputType,
+        pubkey: bytes,
+        signature: bytes = None,
+        pubkeys: Optional[List[bytes]] = None,
+        pubkeyhash: Optional[bytes] = None,
     ) -> bytes:
         return scripts.input_derive_script(
-            txi, self.coin, self.get_hash_type(), pubkey, signature
+            txi, self.coin, self.hash_type, pubkey, signature, pubkeys, pubkeyhash
         )
 
     # BIP-0143
@@ -517,7 +642,12 @@ class Bitcoin:
     def hash143_add_output(self, txo: TxOutputType, script_pubkey) -> None:
         writers.write_tx_output(self.h_outputs, txo, script_pubkey)
 
-    def hash143_preimage_hash(self, txi: TxInputType, pubkeyhash: bytes) -> bytes:
+    def hash143_preimage_hash(
+        self,
+        txi: TxInputType,
+        pubkeyhash: bytes,
+        pubkeys: Optional[List[bytes]] = None,
+    ) -> bytes:
         h_preimage = HashWriter(sha256())
 
         # nVersion
@@ -540,7 +670,7 @@ class Bitcoin:
         writers.write_uint32(h_preimage, txi.prev_index)
 
         # scriptCode
-        script_code = scripts.bip143_derive_script_code(txi, pubkeyhash)
+        script_code = scripts.bip143_derive_script_code(txi, pubkeyhash, pubkeys)
         writers.write_bytes_prefixed(h_preimage, script_code)
 
         # amount
@@ -559,7 +689,7 @@ class Bitcoin:
         writers.write_uint32(h_preimage, self.tx.lock_time)
 
         # nHashType
-        writers.write_uint32(h_preimage, self.get_hash_type())
+        writers.write_uint32(h_preimage, self.hash_type)
 
         return writers.get_tx_hash(h_preimage, double=self.coin.sign_hash_double)
 
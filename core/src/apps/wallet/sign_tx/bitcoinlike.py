@@ -1,4 +1,3 @@
-import gc
 from micropython import const
 
 from trezor.messages import FailureType
@@ -35,15 +34,14 @@ class Bitcoinlike(Bitcoin):
             raise SigningError(
                 FailureType.ProcessError, "Transaction has changed during signing"
             )
-        public_key, signature = self.sign_bip143_input(txi)
+        public_key, signature, pubkeys = self.sign_bip143_input(txi)
 
         # if multisig, do a sanity check to ensure we are signing with a key that is included in the multisig
         if txi.multisig:
-            multisig.multisig_pubkey_index(txi.multisig, public_key)
+            multisig.multisig_find_pubkey(pubkeys, public_key)
 
         # serialize input with correct signature
-        gc.collect()
-        script_sig = self.input_derive_script(txi, public_key, signature)
+        script_sig = self.input_derive_script(txi, public_key, signature, pubkeys)
         self.write_tx_input(self.serialized_tx, txi, script_sig)
         self.set_serialized_signature(i_sign, signature)
 
@@ -58,6 +56,9 @@ class Bitcoinlike(Bitcoin):
         if not self.coin.negative_fee:
             super().on_negative_fee()
 
+    def uses_legacy_sighash(self) -> bool:
+        return not self.coin.force_bip143
+
     def get_hash_type(self) -> int:
         hashtype = super().get_hash_type()
         if self.coin.fork_id is not None:
@@ -1,4 +1,3 @@
-import gc
 from micropython import const
 
 from trezor.crypto.hashlib import blake256
@@ -11,7 +10,7 @@ from trezor.messages.TxOutputType import TxOutputType
 from trezor.utils import HashWriter, ensure
 
 from apps.common import coininfo, seed
-from apps.wallet.sign_tx import addresses, helpers, multisig, progress, scripts, writers
+from apps.wallet.sign_tx import helpers, multisig, progress, scripts, writers
 from apps.wallet.sign_tx.bitcoin import Bitcoin
 from apps.wallet.sign_tx.common import SigningError, ecdsa_sign
 
@@ -67,6 +66,10 @@ class Decred(Bitcoin):
         await super().confirm_output(txo, script_pubkey)
         self.write_tx_output(self.serialized_tx, txo, script_pubkey)
 
+    def save_serialized_output(self, txo: TxOutputType, script_pubkey: bytes) -> None:
+        # Decred serializes the outputs right away and does not stream them again.
+        pass
+
     async def step4_serialize_inputs(self) -> None:
         writers.write_varint(self.serialized_tx, self.tx.inputs_count)
 
@@ -80,17 +83,18 @@ class Decred(Bitcoin):
             self.wallet_path.check_input(txi_sign)
             self.multisig_fingerprint.check_input(txi_sign)
 
-            key_sign = self.keychain.derive(txi_sign.address_n, self.coin.curve_name)
+            key_sign = self.derive_node(txi_sign.address_n)
             key_sign_pub = key_sign.public_key()
 
+            pubkeys = None
             if txi_sign.script_type == InputScriptType.SPENDMULTISIG:
+                pubkeys = multisig.multisig_get_pubkeys(txi_sign.multisig)
                 prev_pkscript = scripts.output_script_multisig(
-                    multisig.multisig_get_pubkeys(txi_sign.multisig),
-                    txi_sign.multisig.m,
+                    pubkeys, txi_sign.multisig.m
                 )
             elif txi_sign.script_type == InputScriptType.SPENDADDRESS:
                 prev_pkscript = scripts.output_script_p2pkh(
-                    addresses.ecdsa_hash_pubkey(key_sign_pub, self.coin)
+                    self.derive_pubkeyhash(txi_sign.address_n, key_sign_pub)
                 )
             else:
                 raise SigningError("Unsupported input script type")
@@ -120,8 +124,9 @@ class Decred(Bitcoin):
             signature = ecdsa_sign(key_sign, sig_hash)
 
             # serialize input with correct signature
-            gc.collect()
-            script_sig = self.input_derive_script(txi_sign, key_sign_pub, signature)
+            script_sig = self.input_derive_script(
+                txi_sign, key_sign_pub, signature, pubkeys
+            )
             writers.write_tx_input_decred_witness(
                 self.serialized_tx, txi_sign, script_sig
             )
@@ -143,6 +148,9 @@ class Decred(Bitcoin):
                 "Cannot use utxo that has script_version != 0",
             )
 
+    def uses_legacy_sighash(self) -> bool:
+        return False
+
     def hash143_add_input(self, txi: TxInputType) -> None:
         writers.write_tx_input_decred(self.h_prefix, txi)
 
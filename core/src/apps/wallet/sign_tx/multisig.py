@@ -58,6 +58,14 @@ def multisig_pubkey_index(multisig: MultisigRedeemScriptType, pubkey: bytes) ->
     raise MultisigError(FailureType.DataError, "Pubkey not found in multisig script")
 
 
+def multisig_find_pubkey(pubkeys: List[bytes], pubkey: bytes) -> int:
+    # same as multisig_pubkey_index(), for pubkeys which are already derived
+    for i, p in enumerate(pubkeys):
+        if p == pubkey:
+            return i
+    raise MultisigError(FailureType.DataError, "Pubkey not found in multisig script")
+
+
 def multisig_get_pubkey(n: HDNodeType, p: list) -> bytes:
     node = bip32.HDNode(
         depth=n.depth,
@@ -2,6 +2,7 @@ from trezor import ui, utils
 
 _progress = 0
 _steps = 0
+_reported = -1  # percentage last drawn by report(), -1 forces a redraw
 
 
 def init(inputs: int, outputs: int) -> None:
@@ -19,12 +20,18 @@ def advance() -> None:
 
 
 def report_init() -> None:
+    global _reported
+    _reported = -1
     ui.display.clear()
     ui.header("Signing transaction")
 
 
 def report() -> None:
+    global _reported
     if utils.DISABLE_ANIMATION:
         return
-    p = 1000 * _progress // _steps
-    ui.display.loader(p, False, 18, ui.WHITE, ui.BG)
+    p = 100 * _progress // _steps
+    if p == _reported:
+        return  # the loader would not change, skip the redraw
+    _reported = p
+    ui.display.loader(10 * p, False, 18, ui.WHITE, ui.BG)
@@ -10,11 +10,7 @@ from apps.common import address_type
 from apps.common.coininfo import CoinInfo
 from apps.common.writers import empty_bytearray
 from apps.wallet.sign_tx import addresses
-from apps.wallet.sign_tx.multisig import (
-    multisig_get_pubkey_count,
-    multisig_get_pubkeys,
-    multisig_pubkey_index,
-)
+from apps.wallet.sign_tx.multisig import multisig_find_pubkey, multisig_get_pubkeys
 from apps.wallet.sign_tx.writers import (
     write_bytes_fixed,
     write_bytes_unchecked,
@@ -37,7 +33,10 @@ def input_derive_script(
     hash_type: int,
     pubkey: bytes,
     signature: Optional[bytes],
+    pubkeys: Optional[List[bytes]] = None,
+    pubkeyhash: Optional[bytes] = None,
 ) -> bytes:
+    # pubkeys and pubkeyhash are passed if the caller has derived them already
     if txi.script_type == InputScriptType.SPENDADDRESS:
         # p2pkh or p2sh
         return input_script_p2pkh_or_p2sh(pubkey, signature, hash_type)
@@ -47,22 +46,25 @@ def input_derive_script(
 
         if txi.multisig:
             # p2wsh in p2sh
-            pubkeys = multisig_get_pubkeys(txi.multisig)
-            witness_script_hasher = utils.HashWriter(sha256())
-            write_output_script_multisig(witness_script_hasher, pubkeys, txi.multisig.m)
-            witness_script_hash = witness_script_hasher.get_digest()
-            return input_script_p2wsh_in_p2sh(witness_script_hash)
+            if pubkeys is None:
+                pubkeys = multisig_get_pubkeys(txi.multisig)
+            script_hash = witness_script_hash(pubkeys, txi.multisig.m)
+            return input_script_p2wsh_in_p2sh(script_hash)
 
         # p2wpkh in p2sh
-        return input_script_p2wpkh_in_p2sh(addresses.ecdsa_hash_pubkey(pubkey, coin))
+        if pubkeyhash is None:
+            pubkeyhash = addresses.ecdsa_hash_pubkey(pubkey, coin)
+        return input_script_p2wpkh_in_p2sh(pubkeyhash)
     elif txi.script_type == InputScriptType.SPENDWITNESS:
         # native p2wpkh or p2wsh
         return input_script_native_p2wpkh_or_p2wsh()
     elif txi.script_type == InputScriptType.SPENDMULTISIG:
         # p2sh multisig
-        signature_index = multisig_pubkey_index(txi.multisig, pubkey)
+        if pubkeys is None:
+            pubkeys = multisig_get_pubkeys(txi.multisig)
+        signature_index = multisig_find_pubkey(pubkeys, pubkey)
         return input_script_multisig(
-            txi.multisig, signature, signature_index, hash_type, coin
+            txi.multisig, pubkeys, signature, signature_index, hash_type, coin
         )
     else:
         raise ScriptsError(FailureType.ProcessError, "Invalid script type")
@@ -97,28 +99,32 @@ def output_derive_script(txo: TxOutputType, coin: CoinInfo) -> bytes:
         except ValueError:
             raise ScriptsError(FailureType.DataError, "Invalid address")
 
-    if address_type.check(coin.address_type, raw_address):
+    # the version prefix is checked and stripped in one go
+    prefix = address_type.tobytes(coin.address_type)
+    if raw_address.startswith(prefix):
         # p2pkh
-        pubkeyhash = address_type.strip(coin.address_type, raw_address)
-        script = output_script_p2pkh(pubkeyhash)
-        return script
-    elif address_type.check(coin.address_type_p2sh, raw_address):
+        pubkeyhash = raw_address[len(prefix) :]
+        return output_script_p2pkh(pubkeyhash)
+
+    prefix = address_type.tobytes(coin.address_type_p2sh)
+    if raw_address.startswith(prefix):
         # p2sh
-        scripthash = address_type.strip(coin.address_type_p2sh, raw_address)
-        script = output_script_p2sh(scripthash)
-        return script
+        scripthash = raw_address[len(prefix) :]
+        return output_script_p2sh(scripthash)
 
     raise ScriptsError(FailureType.DataError, "Invalid address type")
 
 
 # see https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki#specification
 # item 5 for details
-def bip143_derive_script_code(txi: TxInputType, pubkeyhash: bytes) -> bytearray:
+def bip143_derive_script_code(
+    txi: TxInputType, pubkeyhash: bytes, pubkeys: Optional[List[bytes]] = None
+) -> bytearray:
 
     if txi.multisig:
-        return output_script_multisig(
-            multisig_get_pubkeys(txi.multisig), txi.multisig.m
-        )
+        if pubkeys is None:
+            pubkeys = multisig_get_pubkeys(txi.multisig)
+        return output_script_multisig(pubkeys, txi.multisig.m)
 
     p2pkh = (
         txi.script_type == InputScriptType.SPENDWITNESS
@@ -248,6 +254,12 @@ def input_script_p2wsh_in_p2sh(script_hash: bytes) -> bytearray:
     return w
 
 
+def witness_script_hash(pubkeys: List[bytes], m: int) -> bytes:
+    witness_script_hasher = utils.HashWriter(sha256())
+    write_output_script_multisig(witness_script_hasher, pubkeys, m)
+    return witness_script_hasher.get_digest()
+
+
 # SegWit: Witness getters
 # ===
 
@@ -262,13 +274,14 @@ def witness_p2wpkh(signature: bytes, pubkey: bytes, sighash: int) -> bytearray:
 
 def witness_p2wsh(
     multisig: MultisigRedeemScriptType,
+    pubkeys: List[bytes],
     signature: bytes,
     signature_index: int,
     sighash: int,
 ) -> bytearray:
     # get other signatures, stretch with None to the number of the pubkeys
     signatures = multisig.signatures + [None] * (
-        multisig_get_pubkey_count(multisig) - len(multisig.signatures)
+        len(pubkeys) - len(multisig.signatures)
     )
     # fill in our signature
     if signatures[signature_index]:
@@ -282,7 +295,6 @@ def witness_p2wsh(
     num_of_witness_items = 1 + len(signatures) + 1
 
     # length of the redeem script
-    pubkeys = multisig_get_pubkeys(multisig)
     redeem_script_length = output_script_multisig_length(pubkeys, multisig.m)
 
     # length of the result
@@ -317,6 +329,7 @@ def witness_p2wsh(
 
 def input_script_multisig(
     multisig: MultisigRedeemScriptType,
+    pubkeys: List[bytes],
     signature: bytes,
     signature_index: int,
     sighash: int,
@@ -328,7 +341,6 @@ def input_script_multisig(
     signatures[signature_index] = signature  # our signature
 
     # length of the redeem script
-    pubkeys = multisig_get_pubkeys(multisig)
     redeem_script_length = output_script_multisig_length(pubkeys, multisig.m)
 
     # length of the result
@@ -52,6 +52,35 @@ def write_tx_input_check(w: Writer, i: TxInputType) -> None:
     write_uint64(w, i.amount or 0)
 
 
+def write_tx_output_check(w: Writer, o: TxOutputType) -> None:
+    write_uint64(w, o.amount)
+    write_uint32(w, o.script_type)
+    write_bytes_prefixed(w, o.address.encode() if o.address else b"")
+    write_uint32(w, len(o.address_n))
+    for n in o.address_n:
+        write_uint32(w, n)
+    write_bytes_prefixed(w, o.op_return_data or b"")
+    m = o.multisig
+    if m:
+        write_uint32(w, m.m)
+        if m.nodes:
+            write_uint32(w, len(m.nodes))
+            for node in m.nodes:
+                write_bytes_prefixed(w, node.chain_code)
+                write_bytes_prefixed(w, node.public_key)
+        else:
+            write_uint32(w, len(m.pubkeys))
+            for hd in m.pubkeys:
+                write_bytes_prefixed(w, hd.node.chain_code)
+                write_bytes_prefixed(w, hd.node.public_key)
+                write_uint32(w, len(hd.address_n))
+                for n in hd.address_n:
+                    write_uint32(w, n)
+        write_uint32(w, len(m.address_n))
+        for n in m.address_n:
+            write_uint32(w, n)
+
+
 def write_tx_input_decred(w: Writer, i: TxInputType) -> None:
     write_bytes_reversed(w, i.prev_hash, TX_HASH_SIZE)
     write_uint32(w, i.prev_index or 0)
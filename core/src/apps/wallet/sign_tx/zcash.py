@@ -27,11 +27,14 @@ from apps.wallet.sign_tx.writers import (
 )
 
 if False:
-    from typing import Union
+    from typing import List, Optional, Union
     from apps.wallet.sign_tx.writers import Writer
 
 OVERWINTERED = const(0x80000000)
 
+# all-zero hash used for the unsupported shielded parts of the transaction
+_ZERO_HASH = bytes(TX_HASH_SIZE)
+
 
 class Overwintered(Bitcoinlike):
     def __init__(self, tx: SignTx, keychain: Keychain, coin: CoinInfo) -> None:
@@ -76,6 +79,9 @@ class Overwintered(Bitcoinlike):
     async def sign_nonsegwit_input(self, i_sign: int) -> None:
         await self.sign_nonsegwit_bip143_input(i_sign)
 
+    def uses_legacy_sighash(self) -> bool:
+        return False
+
     def write_tx_header(
         self, w: Writer, tx: Union[SignTx, TransactionType], witness_marker: bool
     ) -> None:
@@ -91,7 +97,12 @@ class Overwintered(Bitcoinlike):
         self.h_sequence = HashWriter(blake2b(outlen=32, personal=b"ZcashSequencHash"))
         self.h_outputs = HashWriter(blake2b(outlen=32, personal=b"ZcashOutputsHash"))
 
-    def hash143_preimage_hash(self, txi: TxInputType, pubkeyhash: bytes) -> bytes:
+    def hash143_preimage_hash(
+        self,
+        txi: TxInputType,
+        pubkeyhash: bytes,
+        pubkeys: Optional[List[bytes]] = None,
+    ) -> bytes:
         h_preimage = HashWriter(
             blake2b(
                 outlen=32,
@@ -112,21 +123,20 @@ class Overwintered(Bitcoinlike):
 
         if self.tx.version == 3:
             # 6. hashJoinSplits
-            write_bytes_fixed(h_preimage, b"\x00" * TX_HASH_SIZE, TX_HASH_SIZE)
+            write_bytes_fixed(h_preimage, _ZERO_HASH, TX_HASH_SIZE)
             # 7. nLockTime
             write_uint32(h_preimage, self.tx.lock_time)
             # 8. expiryHeight
             write_uint32(h_preimage, self.tx.expiry)
             # 9. nHashType
-            write_uint32(h_preimage, self.get_hash_type())
+            write_uint32(h_preimage, self.hash_type)
         elif self.tx.version == 4:
-            zero_hash = b"\x00" * TX_HASH_SIZE
             # 6. hashJoinSplits
-            write_bytes_fixed(h_preimage, zero_hash, TX_HASH_SIZE)
+            write_bytes_fixed(h_preimage, _ZERO_HASH, TX_HASH_SIZE)
             # 7. hashShieldedSpends
-            write_bytes_fixed(h_preimage, zero_hash, TX_HASH_SIZE)
+            write_bytes_fixed(h_preimage, _ZERO_HASH, TX_HASH_SIZE)
             # 8. hashShieldedOutputs
-            write_bytes_fixed(h_preimage, zero_hash, TX_HASH_SIZE)
+            write_bytes_fixed(h_preimage, _ZERO_HASH, TX_HASH_SIZE)
             # 9. nLockTime
             write_uint32(h_preimage, self.tx.lock_time)
             # 10. expiryHeight
@@ -134,7 +144,7 @@ class Overwintered(Bitcoinlike):
             # 11. valueBalance
             write_uint64(h_preimage, 0)
             # 12. nHashType
-            write_uint32(h_preimage, self.get_hash_type())
+            write_uint32(h_preimage, self.hash_type)
         else:
             raise SigningError(
                 FailureType.DataError,
@@ -146,7 +156,7 @@ class Overwintered(Bitcoinlike):
         write_uint32(h_preimage, txi.prev_index)
 
         # 10b / 13b. scriptCode
-        script_code = derive_script_code(txi, pubkeyhash)
+        script_code = derive_script_code(txi, pubkeyhash, pubkeys)
         write_bytes_prefixed(h_preimage, script_code)
 
         # 10c / 13c. value
@@ -158,12 +168,14 @@ class Overwintered(Bitcoinlike):
         return get_tx_hash(h_preimage)
 
 
-def derive_script_code(txi: TxInputType, pubkeyhash: bytes) -> bytearray:
+def derive_script_code(
+    txi: TxInputType, pubkeyhash: bytes, pubkeys: Optional[List[bytes]] = None
+) -> bytearray:
 
     if txi.multisig:
-        return output_script_multisig(
-            multisig_get_pubkeys(txi.multisig), txi.multisig.m
-        )
+        if pubkeys is None:
+            pubkeys = multisig_get_pubkeys(txi.multisig)
+        return output_script_multisig(pubkeys, txi.multisig.m)
 
     p2pkh = txi.script_type == InputScriptType.SPENDADDRESS
     if p2pkh:
@@ -13,12 +13,17 @@
 # This module adds shiny packaging and support for python3.
 #
 
+from micropython import const
+
 if False:
     from typing import Callable
 
 # 58 character alphabet used
 _alphabet = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
 
+# 58^5, the largest power of 58 which still fits in a MicroPython small int
+_DECODE_CHUNK = const(656356768)
+
 
 def encode(data: bytes, alphabet: str = _alphabet) -> str:
     """
@@ -49,15 +54,21 @@ def decode(string: str, alphabet: str = _alphabet) -> bytes:
     string = string.lstrip(alphabet[0])
     newlen = len(string)
 
-    p, acc = 1, 0
-    for c in reversed(string):
-        acc += p * alphabet.index(c)
+    # accumulate the digits in small-int chunks, so that the big integer
+    # is only touched once every five digits
+    acc, chunk, p = 0, 0, 1
+    for c in string:
+        chunk = chunk * 58 + alphabet.index(c)
         p *= 58
+        if p == _DECODE_CHUNK:
+            acc = acc * p + chunk
+            chunk, p = 0, 1
+    acc = acc * p + chunk
 
     result = []
     while acc > 0:
-        acc, mod = divmod(acc, 256)
-        result.append(mod)
+        result.append(acc & 0xFF)
+        acc >>= 8
 
     return bytes((b for b in reversed(result + [0] * (origlen - newlen))))
 
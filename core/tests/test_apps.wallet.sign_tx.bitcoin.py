@@ -0,0 +1,106 @@
+from common import *
+
+from trezor.crypto import bip39
+from trezor.messages.SignTx import SignTx
+from trezor.messages.TransactionType import TransactionType
+from trezor.messages.TxAck import TxAck
+from trezor.messages.TxOutputType import TxOutputType
+from trezor.messages import OutputScriptType
+
+from apps.common import coins
+from apps.common.seed import Keychain
+from apps.wallet.sign_tx import bitcoin
+
+
+class CountingKeychain(Keychain):
+    def __init__(self, seed, namespaces):
+        super().__init__(seed, namespaces)
+        self.derivations = 0
+
+    def derive(self, node_path, curve_name="secp256k1"):
+        self.derivations += 1
+        return super().derive(node_path, curve_name)
+
+
+class TestSignerNodeCache(unittest.TestCase):
+
+    def setUp(self):
+        seed = bip39.seed('alcohol woman abuse must during monitor noble actual mixed trade anger aisle', '')
+        self.coin = coins.by_name('Bitcoin')
+        self.keychain = CountingKeychain(seed, [[self.coin.curve_name]])
+        tx = SignTx(coin_name='Bitcoin', version=1, lock_time=0, inputs_count=1, outputs_count=1)
+        self.signer = bitcoin.Bitcoin(tx, self.keychain, self.coin)
+
+    def test_kept_node_is_reused(self):
+        path = [84 | 0x80000000, 0x80000000, 0x80000000, 0, 0]
+        node = self.signer.derive_node(path, keep=True)
+        self.assertEqual(self.keychain.derivations, 1)
+        self.assertTrue(self.signer.derive_node(path) is node)
+        self.assertEqual(self.keychain.derivations, 1)
+
+        pubkeyhash = self.signer.derive_pubkeyhash(path, node.public_key())
+        self.assertEqual(self.signer.derive_pubkeyhash(path, node.public_key()), pubkeyhash)
+        self.assertEqual(self.keychain.derivations, 1)
+
+    def test_node_not_kept(self):
+        path = [44 | 0x80000000, 0x80000000, 0x80000000, 1, 0]
+        node = self.signer.derive_node(path)
+        self.assertFalse(self.signer.derive_node(path) is node)
+        self.assertEqual(self.keychain.derivations, 2)
+
+        # pubkey hashes are only kept together with their nodes, and never derived
+        self.signer.derive_pubkeyhash(path, node.public_key())
+        self.assertEqual(self.keychain.derivations, 2)
+        self.assertEqual(self.signer.pubkeyhash_cache, {})
+
+    def test_cache_full(self):
+        paths = [[84 | 0x80000000, 0x80000000, 0x80000000, 0, i] for i in range(20)]
+        for path in paths:
+            self.signer.derive_node(path, keep=True)
+        kept = len(self.signer.node_cache)
+        self.assertTrue(0 < kept < len(paths))
+
+        # the first nodes stay in the cache, the ones over the limit are derived again
+        self.keychain.derivations = 0
+        for path in paths:
+            self.signer.derive_node(path)
+        self.assertEqual(self.keychain.derivations, len(paths) - kept)
+        for path in paths[:kept]:
+            self.assertTrue(tuple(path) in self.signer.node_cache)
+
+
+class TestSignerSerializedOutputs(unittest.TestCase):
+
+    def test_outputs_over_limit(self):
+        coin = coins.by_name('Bitcoin')
+        tx = SignTx(coin_name='Bitcoin', version=1, lock_time=0, inputs_count=1, outputs_count=200)
+        signer = bitcoin.Bitcoin(tx, None, coin)
+        txo = TxOutputType(address='1MJ2tj2ThBE62zXbBYA5ZaN3fdve5CPAz1',
+                           amount=390000 - 10000,
+                           script_type=OutputScriptType.PAYTOADDRESS,
+                           address_n=[],
+                           multisig=None)
+        script_pubkey = signer.output_derive_script(txo)
+        expected = signer.serialize_tx_output(txo, script_pubkey)
+
+        for i in range(tx.outputs_count):
+            signer.save_serialized_output(txo, script_pubkey)
+        saved = len(signer.serialized_outputs)
+        self.assertTrue(0 < saved < tx.outputs_count)
+
+        # the outputs past the limit are serialized again from the streamed output
+        for i in (0, saved - 1, saved, tx.outputs_count - 1):
+            serialize = signer.serialize_output(i)
+            self.assertEqual(serialize.send(None).details.request_index, i)
+            with self.assertRaises(StopIteration):
+                serialize.send(TxAck(tx=TransactionType(outputs=[txo])))
+            self.assertEqual(signer.serialized_tx, expected)
+
+            # the same for legacy signing in Step 4
+            w = bytearray()
+            signer.write_serialized_output(w, i, txo)
+            self.assertEqual(w, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
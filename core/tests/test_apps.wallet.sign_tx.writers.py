@@ -1,7 +1,11 @@
 from common import *
 
+from trezor.messages.HDNodePathType import HDNodePathType
+from trezor.messages.HDNodeType import HDNodeType
+from trezor.messages.MultisigRedeemScriptType import MultisigRedeemScriptType
 from trezor.messages.TxInputType import TxInputType
-from trezor.messages import InputScriptType
+from trezor.messages.TxOutputType import TxOutputType
+from trezor.messages import InputScriptType, OutputScriptType
 
 from apps.common import coins
 from apps.common.seed import Keychain
@@ -50,5 +54,43 @@ class TestWriters(unittest.TestCase):
             inp.prev_hash = bad_prevhash
             self.assertRaises(AssertionError, writers.write_tx_input_check, b, inp)
 
+    def test_tx_output_check(self):
+        def node(chain_code):
+            return HDNodeType(
+                depth=0,
+                fingerprint=0,
+                child_num=0,
+                chain_code=chain_code,
+                public_key=b"\x02" + b"\x01" * 32,
+            )
+
+        def check(out):
+            b = bytearray()
+            writers.write_tx_output_check(b, out)
+            return b
+
+        out = TxOutputType(
+            address_n=[1, 0],
+            amount=390000,
+            script_type=OutputScriptType.PAYTOMULTISIG,
+            multisig=MultisigRedeemScriptType(
+                pubkeys=[HDNodePathType(node=node(b"\x00" * 32), address_n=[0])],
+                m=1,
+            ),
+        )
+        b = check(out)
+
+        # the cosigner keys are derived with the chain code, it has to be covered
+        out.multisig.pubkeys[0].node.chain_code = b"\xff" * 32
+        self.assertNotEqual(check(out), b)
+
+        out.multisig = MultisigRedeemScriptType(
+            nodes=[node(b"\x00" * 32)], address_n=[0], m=1
+        )
+        b = check(out)
+        out.multisig.nodes[0].chain_code = b"\xff" * 32
+        self.assertNotEqual(check(out), b)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -72,6 +72,13 @@ class TestCryptoBase58(unittest.TestCase):
         ('03e7595c3e6b58f907bee951dc29796f3757307e700ecf3d09307a0cc4a564eba3', '8b82mpnH8YX1E9RHnU2a2YgLTZ8ooevEGP9N15c1yFqhoBvJur'),
     ]
 
+    def test_decode_encode(self):
+        # leading zeros and lengths around the decoder chunk boundaries
+        for zeros in range(3):
+            for length in range(20):
+                data = b'\x00' * zeros + bytes(range(1, length + 1))
+                self.assertEqual(base58.decode(base58.encode(data)), data)
+
     def test_decode_check(self):
         for a, b in self.vectors:
             self.assertEqual(base58.decode_check(b), unhexlify(a))
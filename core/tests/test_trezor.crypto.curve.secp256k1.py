@@ -1,6 +1,6 @@
 from common import *
 
-from trezor.crypto import random
+from trezor.crypto import der, random
 from trezor.crypto.curve import secp256k1
 
 if not utils.BITCOIN_ONLY:
@@ -141,6 +141,14 @@ class TestCryptoSecp256k1(Secp256k1Common, unittest.TestCase):
     def __init__(self):
         self.impl = secp256k1
 
+    def test_sign_der(self):
+        for _ in range(100):
+            sk = self.impl.generate_secret()
+            dig = random.bytes(32)
+            sig = self.impl.sign(sk, dig)
+            sigder = self.impl.sign_der(sk, dig)
+            self.assertEqual(sigder, der.encode_seq((sig[1:33], sig[33:65])))
+
 @unittest.skipUnless(not utils.BITCOIN_ONLY, "altcoin")
 class TestCryptoSecp256k1Zkp(Secp256k1Common, unittest.TestCase):
     def __init__(self):
@@ -33,6 +33,28 @@
 #include "sha2.h"
 #include "memzero.h"
 
+/*
+ * HARDWARE ACCELERATION NOTE:
+ * The SHA-256 compression function uses the CPU's SHA instructions when
+ * they are available:
+ *
+ *   - x86-64: SHA extensions (SHA-NI), detected at runtime using CPUID,
+ *   - AArch64: ARMv8 cryptography extensions, when the compiler targets
+ *     them (e.g. -march=armv8-a+crypto).
+ *
+ * Other targets (including Cortex-M) use the portable implementation.
+ * Define SHA2_NO_HW_ACCEL to always use the portable implementation.
+ */
+#if !defined(SHA2_NO_HW_ACCEL) && defined(__x86_64__) && defined(__GNUC__)
+#define SHA2_USE_SHANI
+#include <cpuid.h>
+#include <immintrin.h>
+#elif !defined(SHA2_NO_HW_ACCEL) && defined(__aarch64__) && defined(__AARCH64EL__) && \
+    (defined(__ARM_FEATURE_CRYPTO) || defined(__ARM_FEATURE_SHA2))
+#define SHA2_USE_ARMV8
+#include <arm_neon.h>
+#endif
+
 /*
  * ASSERT NOTE:
  * Some sanity checking code is included using assert().  On my FreeBSD
@@ -698,7 +720,7 @@ void sha256_Init(SHA256_CTX* context) {
 	(h) = T1 + Sigma0_256(a) + Maj((a), (b), (c)); \
 	j++
 
-void sha256_Transform(const sha2_word32* state_in, const sha2_word32* data, sha2_word32* state_out) {
+static void sha256_Transform_generic(const sha2_word32* state_in, const sha2_word32* data, sha2_word32* state_out) {
 	sha2_word32	a = 0, b = 0, c = 0, d = 0, e = 0, f = 0, g = 0, h = 0, s0 = 0, s1 = 0;
 	sha2_word32	T1 = 0;
 	sha2_word32 W256[16] = {0};
@@ -755,7 +777,7 @@ void sha256_Transform(const sha2_word32* state_in, const sha2_word32* data, sha2
 
 #else /* SHA2_UNROLL_TRANSFORM */
 
-void sha256_Transform(const sha2_word32* state_in, const sha2_word32* data, sha2_word32* state_out) {
+static void sha256_Transform_generic(const sha2_word32* state_in, const sha2_word32* data, sha2_word32* state_out) {
 	sha2_word32	a = 0, b = 0, c = 0, d = 0, e = 0, f = 0, g = 0, h = 0, s0 = 0, s1 = 0;
 	sha2_word32	T1 = 0, T2 = 0 , W256[16] = {0};
 	int		j = 0;
@@ -826,6 +848,177 @@ void sha256_Transform(const sha2_word32* state_in, const sha2_word32* data, sha2
 
 #endif /* SHA2_UNROLL_TRANSFORM */
 
+#if defined(SHA2_USE_SHANI)
+
+/*
+ * Process the given number of 64-byte blocks using the SHA-NI instructions.
+ * If bswap is set, the data is the message in big-endian byte order (as fed
+ * to sha256_Update), otherwise it is in host order (as fed to
+ * sha256_Transform).
+ */
+__attribute__((target("sha,sse4.1")))
+static void sha256_Compress_shani(const sha2_word32* state_in, const sha2_byte* data, size_t blocks, int bswap, sha2_word32* state_out) {
+	const __m128i	MASK = _mm_set_epi64x(0x0c0d0e0f08090a0bULL, 0x0405060700010203ULL);
+	__m128i		STATE0, STATE1, ABEF_SAVE, CDGH_SAVE, MSG, TMP, W[4];
+	int		j = 0;
+
+	/* Load the state and rearrange it to ABEF, CDGH */
+	TMP = _mm_loadu_si128((const __m128i*)&state_in[0]);
+	STATE1 = _mm_loadu_si128((const __m128i*)&state_in[4]);
+	TMP = _mm_shuffle_epi32(TMP, 0xB1);		/* CDAB */
+	STATE1 = _mm_shuffle_epi32(STATE1, 0x1B);	/* EFGH */
+	STATE0 = _mm_alignr_epi8(TMP, STATE1, 8);	/* ABEF */
+	STATE1 = _mm_blend_epi16(STATE1, TMP, 0xF0);	/* CDGH */
+
+	while (blocks > 0) {
+		ABEF_SAVE = STATE0;
+		CDGH_SAVE = STATE1;
+
+		for (j = 0; j < 16; j++) {
+			if (j < 4) {
+				W[j] = _mm_loadu_si128((const __m128i*)(data + 16 * j));
+				if (bswap) {
+					W[j] = _mm_shuffle_epi8(W[j], MASK);
+				}
+			} else {
+				/* Message schedule: W[j-4] is replaced by W[j] */
+				TMP = _mm_alignr_epi8(W[(j+3)&3], W[(j+2)&3], 4);
+				W[j&3] = _mm_sha256msg1_epu32(W[j&3], W[(j+1)&3]);
+				W[j&3] = _mm_add_epi32(W[j&3], TMP);
+				W[j&3] = _mm_sha256msg2_epu32(W[j&3], W[(j+3)&3]);
+			}
+			/* Four rounds */
+			MSG = _mm_add_epi32(W[j&3], _mm_loadu_si128((const __m128i*)&K256[4 * j]));
+			STATE1 = _mm_sha256rnds2_epu32(STATE1, STATE0, MSG);
+			MSG = _mm_shuffle_epi32(MSG, 0x0E);
+			STATE0 = _mm_sha256rnds2_epu32(STATE0, STATE1, MSG);
+		}
+
+		STATE0 = _mm_add_epi32(STATE0, ABEF_SAVE);
+		STATE1 = _mm_add_epi32(STATE1, CDGH_SAVE);
+
+		data += SHA256_BLOCK_LENGTH;
+		blocks--;
+	}
+
+	/* Rearrange the state back to ABCD, EFGH and store it */
+	TMP = _mm_shuffle_epi32(STATE0, 0x1B);		/* FEBA */
+	STATE1 = _mm_shuffle_epi32(STATE1, 0xB1);	/* DCHG */
+	STATE0 = _mm_blend_epi16(TMP, STATE1, 0xF0);	/* DCBA */
+	STATE1 = _mm_alignr_epi8(STATE1, TMP, 8);	/* ABEF */
+	_mm_storeu_si128((__m128i*)&state_out[0], STATE0);
+	_mm_storeu_si128((__m128i*)&state_out[4], STATE1);
+}
+
+static int sha256_HasHwAccel(void) {
+	static int	has_shani = -1;
+	unsigned int	eax = 0, ebx = 0, ecx = 0, edx = 0;
+
+	if (has_shani < 0) {
+		has_shani = 0;
+		/* SSE4.1: CPUID.01H:ECX[19], SHA: CPUID.(EAX=07H, ECX=0):EBX[29] */
+		if (__get_cpuid(1, &eax, &ebx, &ecx, &edx) && (ecx & (1 << 19)) &&
+		    __get_cpuid_count(7, 0, &eax, &ebx, &ecx, &edx) && (ebx & (1 << 29))) {
+			has_shani = 1;
+		}
+	}
+	return has_shani;
+}
+
+#define sha256_Compress_hw sha256_Compress_shani
+
+#elif defined(SHA2_USE_ARMV8)
+
+/*
+ * Process the given number of 64-byte blocks using the ARMv8 SHA-256
+ * instructions. The data layout is the same as for sha256_Compress_shani().
+ */
+static void sha256_Compress_armv8(const sha2_word32* state_in, const sha2_byte* data, size_t blocks, int bswap, sha2_word32* state_out) {
+	uint32x4_t	STATE0, STATE1, ABCD_SAVE, EFGH_SAVE, MSG, TMP, W[4];
+	int		j = 0;
+
+	STATE0 = vld1q_u32(&state_in[0]);
+	STATE1 = vld1q_u32(&state_in[4]);
+
+	while (blocks > 0) {
+		ABCD_SAVE = STATE0;
+		EFGH_SAVE = STATE1;
+
+		for (j = 0; j < 16; j++) {
+			if (j < 4) {
+				W[j] = vreinterpretq_u32_u8(vld1q_u8(data + 16 * j));
+				if (bswap) {
+					W[j] = vreinterpretq_u32_u8(vrev32q_u8(vreinterpretq_u8_u32(W[j])));
+				}
+			} else {
+				/* Message schedule: W[j-4] is replaced by W[j] */
+				W[j&3] = vsha256su0q_u32(W[j&3], W[(j+1)&3]);
+				W[j&3] = vsha256su1q_u32(W[j&3], W[(j+2)&3], W[(j+3)&3]);
+			}
+			/* Four rounds */
+			MSG = vaddq_u32(W[j&3], vld1q_u32(&K256[4 * j]));
+			TMP = STATE0;
+			STATE0 = vsha256hq_u32(STATE0, STATE1, MSG);
+			STATE1 = vsha256h2q_u32(STATE1, TMP, MSG);
+		}
+
+		STATE0 = vaddq_u32(STATE0, ABCD_SAVE);
+		STATE1 = vaddq_u32(STATE1, EFGH_SAVE);
+
+		data += SHA256_BLOCK_LENGTH;
+		blocks--;
+	}
+
+	vst1q_u32(&state_out[0], STATE0);
+	vst1q_u32(&state_out[4], STATE1);
+}
+
+static int sha256_HasHwAccel(void) {
+	return 1;
+}
+
+#define sha256_Compress_hw sha256_Compress_armv8
+
+#endif
+
+void sha256_Transform(const sha2_word32* state_in, const sha2_word32* data, sha2_word32* state_out) {
+#if defined(SHA2_USE_SHANI) || defined(SHA2_USE_ARMV8)
+	if (sha256_HasHwAccel()) {
+		sha256_Compress_hw(state_in, (const sha2_byte*)data, 1, 0, state_out);
+		return;
+	}
+#endif
+	sha256_Transform_generic(state_in, data, state_out);
+}
+
+/*
+ * Process as many complete blocks of the big-endian message as there are
+ * in len, using buffer as scratch space for the portable implementation.
+ * Returns the number of bytes processed.
+ */
+static size_t sha256_Blocks(sha2_word32* state, const sha2_byte* data, size_t len, sha2_word32* buffer) {
+	size_t		blocks = len / SHA256_BLOCK_LENGTH;
+
+#if defined(SHA2_USE_SHANI) || defined(SHA2_USE_ARMV8)
+	if (blocks > 0 && sha256_HasHwAccel()) {
+		sha256_Compress_hw(state, data, blocks, 1, state);
+		return blocks * SHA256_BLOCK_LENGTH;
+	}
+#endif
+	for (size_t i = 0; i < blocks; i++) {
+		MEMCPY_BCOPY(buffer, data, SHA256_BLOCK_LENGTH);
+#if BYTE_ORDER == LITTLE_ENDIAN
+		/* Convert TO host byte order */
+		for (int j = 0; j < 16; j++) {
+			REVERSE32(buffer[j],buffer[j]);
+		}
+#endif
+		sha256_Transform_generic(state, buffer, state);
+		data += SHA256_BLOCK_LENGTH;
+	}
+	return blocks * SHA256_BLOCK_LENGTH;
+}
+
 void sha256_Update(SHA256_CTX* context, const sha2_byte *data, size_t len) {
 	unsigned int	freespace = 0, usedspace = 0;
 
@@ -861,19 +1054,12 @@ void sha256_Update(SHA256_CTX* context, const sha2_byte *data, size_t len) {
 			return;
 		}
 	}
-	while (len >= SHA256_BLOCK_LENGTH) {
+	if (len >= SHA256_BLOCK_LENGTH) {
 		/* Process as many complete blocks as we can */
-		MEMCPY_BCOPY(context->buffer, data, SHA256_BLOCK_LENGTH);
-#if BYTE_ORDER == LITTLE_ENDIAN
-		/* Convert TO host byte order */
-		for (int j = 0; j < 16; j++) {
-			REVERSE32(context->buffer[j],context->buffer[j]);
-		}
-#endif
-		sha256_Transform(context->state, context->buffer, context->state);
-		context->bitcount += SHA256_BLOCK_LENGTH << 3;
-		len -= SHA256_BLOCK_LENGTH;
-		data += SHA256_BLOCK_LENGTH;
+		size_t processed = sha256_Blocks(context->state, data, len, context->buffer);
+		context->bitcount += (uint64_t)processed << 3;
+		len -= processed;
+		data += processed;
 	}
 	if (len > 0) {
 		/* There's left-overs, so save 'em */